@@ -1,47 +1,100 @@
 import streamlit as st
 from mistralai import Mistral
 from mistralai.models import OCRResponse
-from pathlib import Path
+import os
 import requests
 import re
 import io
-import base64 
+import hashlib
+import tempfile
+import pybase64
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_local_storage import LocalStorage
 
 # --- Constants ---
 SUPPORTED_IMAGE_TYPES = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp')
 SUPPORTED_PDF_TYPES = ('.pdf',)
 SUPPORTED_FILE_TYPES = SUPPORTED_IMAGE_TYPES + SUPPORTED_PDF_TYPES
+_UPLOADER_EXTS = [ext.lstrip('.') for ext in SUPPORTED_FILE_TYPES]
+# Image types the OCR endpoint accepts inline as an image_url; others (.gif, .bmp) go through the upload path.
+INLINE_IMAGE_MIME_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp'}
+# Mistral OCR rejects files above 50 MB, so URL downloads stop there.
+MAX_DOWNLOAD_BYTES = 50 * 1024 * 1024
+# OCR results survive restarts here; only the most recently used ones are kept.
+OCR_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".streamlit", "ocr_cache")
+MAX_PERSISTED_OCR_RESULTS = 50
+# Mistral OCR image placeholders link an image id to itself, e.g. ![img-0.jpeg](img-0.jpeg).
+IMAGE_PLACEHOLDER_PATTERN = re.compile(r"!\[\s*([^\]]+?)\s*\]\(\s*\1\s*\)")
 
 # --- Helper Functions ---
 
+def get_file_hash(data: bytes) -> str:
+    """Fingerprints file bytes so cached functions can key on a short digest instead of the whole file."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def get_file_info(name_or_url: str) -> tuple[str, bool, bool, str | None]:
+    """
+    Derives the file name stem, the image/PDF flags and the inline OCR MIME type
+    (None if the file must be uploaded) from a file name or URL.
+    All of them come from one extension, so the preview and the OCR routing always agree.
+    """
+    path_part = name_or_url.rpartition('/')[2].partition('?')[0].partition('#')[0]
+    file_name_stem, ext = os.path.splitext(path_part)
+    ext = ext.lower()
+    return (
+        file_name_stem or "file_from_url",
+        ext in SUPPORTED_IMAGE_TYPES,
+        ext in SUPPORTED_PDF_TYPES,
+        INLINE_IMAGE_MIME_TYPES.get(ext)
+    )
+
 def replace_images_in_markdown(markdown_str: str, images_dict: dict) -> str:
-    """Replaces image placeholders with base64 data URIs."""
+    """
+    Replaces image placeholders with base64 data URIs.
+    Exact `![id](id)` placeholders are swapped with str.replace; the regex
+    only runs for ids that may still have whitespace-padded placeholders.
+    """
+    pending = {}
     for img_id, base64_data_uri in images_dict.items():
-        placeholder_pattern = re.compile(rf"!\[\s*{re.escape(img_id)}\s*\]\(\s*{re.escape(img_id)}\s*\)")
-        markdown_str = placeholder_pattern.sub(f"![{img_id}]({base64_data_uri})", markdown_str)
-    return markdown_str
+        placeholder = f"![{img_id}]({img_id})"
+        replacement = f"![{img_id}]({base64_data_uri})"
+        replaced = markdown_str.replace(placeholder, replacement)
+        # Every hit changes the length by the same amount, so the hit count needs no extra scan.
+        growth = len(replacement) - len(placeholder)
+        hits = (len(replaced) - len(markdown_str)) // growth if growth else markdown_str.count(placeholder)
+        markdown_str = replaced
+        # Each replaced placeholder leaves the id once (in the alt text); any extra occurrence needs the regex.
+        if markdown_str.count(img_id) != hits:
+            pending[img_id] = base64_data_uri
+    if not pending:
+        return markdown_str
+    ids_alternation = "|".join(re.escape(img_id) for img_id in pending)
+    placeholder_pattern = re.compile(rf"!\[\s*({ids_alternation})\s*\]\(\s*\1\s*\)")
+    return placeholder_pattern.sub(lambda m: f"![{m.group(1)}]({pending[m.group(1)]})", markdown_str)
+
+def strip_image_placeholders(markdown_str: str) -> str:
+    """Turns image placeholders into plain-text markers so they don't render as broken images."""
+    if "![" not in markdown_str:
+        return markdown_str
+    return IMAGE_PLACEHOLDER_PATTERN.sub(r"*[Image: \1]*", markdown_str)
 
-def get_combined_markdown_optimized(ocr_response: OCRResponse) -> str:
+def get_combined_markdown_optimized(ocr_response: OCRResponse, embed_images: bool) -> str:
     """Combines OCR text and images into a single markdown document."""
-    markdowns: list[str] = []
-    for page in ocr_response.pages:
+    buf = io.StringIO()
+    for i, page in enumerate(ocr_response.pages):
         image_data = {}
-        if page.images:
+        if embed_images and page.images:
             for img in page.images:
-                if img.image_base64 and not img.image_base64.startswith('data:image'):
-                    image_data[img.id] = f"data:image/png;base64,{img.image_base64}"
-                elif img.image_base64:
-                    image_data[img.id] = img.image_base64
-        page_md = page.markdown if hasattr(page, 'markdown') and page.markdown else ""
-        markdowns.append(replace_images_in_markdown(page_md, image_data))
-    return "\n\n".join(markdowns)
-
-def display_pdf(pdf_data: bytes, height: int = 600) -> str:
-    """Generates an HTML iframe tag to embed a PDF from bytes."""
-    base64_pdf = base64.b64encode(pdf_data).decode('utf-8')
-    pdf_html = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="{height}px" type="application/pdf"></iframe>'
-    return pdf_html
+                b64 = img.image_base64
+                if not b64:
+                    continue
+                image_data[img.id] = b64 if b64[:5] == 'data:' else f"data:image/png;base64,{b64}"
+        page_md = getattr(page, "markdown", "") or ""
+        if i:
+            buf.write("\n\n")
+        buf.write(replace_images_in_markdown(page_md, image_data) if embed_images else strip_image_placeholders(page_md))
+    return buf.getvalue()
 
 # --- NEW FUNCTION: Generate Standalone HTML ---
 def create_html_content(markdown_text: str) -> str:
@@ -109,13 +162,37 @@ def create_html_content(markdown_text: str) -> str:
 
 # --- Caching Functions ---
 
+@st.cache_resource(show_spinner=False, max_entries=8, ttl="1h")
+def get_mistral_client(api_key: str) -> Mistral:
+    """
+    Creates one Mistral client per API key so its HTTP connection pool is reused.
+    Bounded so keys entered by past sessions don't keep live clients in memory until restart.
+    """
+    return Mistral(api_key=api_key)
+
 @st.cache_data(show_spinner="Downloading file from URL...")
 def get_data_from_url(url: str) -> bytes:
     """Downloads file from URL and caches the result."""
     try:
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-        return response.content
+        with requests.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            size_limit_error = f"URL download error: file is larger than {MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB."
+            try:
+                expected_size = max(int(response.headers.get('Content-Length') or 0), 0)
+            except ValueError:
+                expected_size = 0
+            if expected_size > MAX_DOWNLOAD_BYTES:
+                st.error(size_limit_error)
+                return None
+
+            # BytesIO.getvalue() hands back its internal buffer without copying, so peak memory stays ~1x the file.
+            buf = io.BytesIO()
+            for chunk in response.iter_content(chunk_size=65536):
+                if buf.tell() + len(chunk) > MAX_DOWNLOAD_BYTES:
+                    st.error(size_limit_error)
+                    return None
+                buf.write(chunk)
+            return buf.getvalue()
     except requests.exceptions.RequestException as e:
         st.error(f"URL download error: {e}")
         return None
@@ -123,51 +200,132 @@ def get_data_from_url(url: str) -> bytes:
         st.error(f"Unexpected URL error: {e}")
         return None
 
-@st.cache_data(show_spinner="Uploading file and running OCR... This may take a moment.")
-def get_ocr_result(api_key: str, file_data: bytes, file_name_stem: str, is_image: bool) -> str:
+def load_persisted_ocr_result(cache_key: str) -> str | None:
+    """Reads a persisted OCR result and marks it as recently used; returns None if there is none."""
+    path = os.path.join(OCR_CACHE_DIR, f"{cache_key}.md")
+    try:
+        with open(path, encoding="utf-8") as f:
+            markdown = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return markdown
+
+def persist_ocr_result(cache_key: str, markdown: str) -> None:
+    """Writes an OCR result to disk, then deletes the least recently used ones beyond MAX_PERSISTED_OCR_RESULTS."""
+    try:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=OCR_CACHE_DIR, suffix=".tmp", delete=False) as f:
+            f.write(markdown)
+        os.replace(f.name, os.path.join(OCR_CACHE_DIR, f"{cache_key}.md"))
+
+        entries = [entry for entry in os.scandir(OCR_CACHE_DIR) if entry.name.endswith(".md")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[MAX_PERSISTED_OCR_RESULTS:]:
+            os.remove(entry.path)
+    except OSError as e:
+        print(f"Error persisting OCR result {cache_key}: {e}")
+
+# No spinner here: the batch path calls this from worker threads, so callers show one instead.
+@st.cache_data(show_spinner=False, max_entries=MAX_PERSISTED_OCR_RESULTS)
+def get_ocr_result(api_key: str, file_hash: str, _file_data: bytes, file_name_stem: str, inline_mime_type: str | None, embed_images: bool = False) -> str:
     """
-    Runs the full OCR process and CACHES the result.
+    Runs the full OCR process and CACHES the result, in memory and in OCR_CACHE_DIR
+    (~/.streamlit/ocr_cache/) so it survives app restarts. Both keep at most
+    MAX_PERSISTED_OCR_RESULTS entries; the least recently used are evicted first.
+    The cache is keyed on file_hash; the leading underscore keeps Streamlit from hashing _file_data itself.
     CRITICALLY: Cleans up the uploaded file from Mistral servers.
     """
-    client = None
+    # The API key is part of the key so users never read each other's results; only its digest reaches the disk.
+    cache_key = hashlib.blake2b(
+        f"{api_key}\0{file_hash}\0{inline_mime_type}\0{embed_images}".encode(), digest_size=16
+    ).hexdigest()
+    persisted = load_persisted_ocr_result(cache_key)
+    if persisted is not None:
+        return persisted
+
+    client = get_mistral_client(api_key)
     mistral_uploaded_file = None
     try:
-        client = Mistral(api_key=api_key)
-        
-        # 1. Upload file to Mistral (temporary)
-        upload_file_name = f"{file_name_stem}.tmp"
-        mistral_uploaded_file = client.files.upload(
-            file={"file_name": upload_file_name, "content": file_data},
-            purpose="ocr"
-        )
-        
-        # 2. Get a short-lived URL for processing
-        signed_url = client.files.get_signed_url(file_id=mistral_uploaded_file.id, expiry=60)
-        
-        # 3. Run OCR
-        ocr_response = client.ocr.process(
-            document={
+        if inline_mime_type:
+            # Supported images are sent inline as a data URI: no upload, signed URL or cleanup needed.
+            base64_image = pybase64.b64encode(_file_data).decode('ascii')
+            document = {
+                "type": "image_url",
+                "image_url": f"data:{inline_mime_type};base64,{base64_image}"
+            }
+        else:
+            # 1. Upload file to Mistral (temporary)
+            upload_file_name = f"{file_name_stem}.tmp"
+            mistral_uploaded_file = client.files.upload(
+                file={"file_name": upload_file_name, "content": _file_data},
+                purpose="ocr"
+            )
+
+            # 2. Get a short-lived URL for processing
+            signed_url = client.files.get_signed_url(file_id=mistral_uploaded_file.id, expiry=60)
+            document = {
                 "type": "document_url",
                 "document_url": signed_url.url
-            },
+            }
+
+        # 3. Run OCR
+        ocr_response = client.ocr.process(
+            document=document,
             model="mistral-ocr-latest",
-            include_image_base64=True
+            include_image_base64=embed_images
         )
         
         # 4. Get the final markdown
-        return get_combined_markdown_optimized(ocr_response)
+        markdown = get_combined_markdown_optimized(ocr_response, embed_images)
+        persist_ocr_result(cache_key, markdown)
+        return markdown
 
     except Exception as e:
         raise e
         
     finally:
-        if client and mistral_uploaded_file:
+        if mistral_uploaded_file:
             try:
                 client.files.delete(mistral_uploaded_file.id)
                 print(f"Successfully deleted temporary file: {mistral_uploaded_file.id}")
             except Exception as e:
                 print(f"Error deleting file {mistral_uploaded_file.id}: {e}")
 
+def get_ocr_results_batch(api_key: str, files: list[tuple[str, bytes]], embed_images: bool = False) -> list[tuple[str, str | None, str | None]]:
+    """
+    Runs OCR on several (file name, bytes) pairs concurrently.
+    Each file still goes through the cached get_ocr_result; all workers share one Mistral client.
+    Returns (file name, markdown, error) per file so one failure doesn't discard the files that succeeded.
+    """
+    get_mistral_client(api_key)  # Create the shared client once, before the workers start.
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(
+        max_workers=min(8, len(files)),
+        initializer=add_script_run_ctx,
+        initargs=(None, ctx)
+    ) as executor:
+        futures = []
+        for name, file_data in files:
+            file_name_stem, _, _, inline_mime_type = get_file_info(name)
+            futures.append(executor.submit(
+                get_ocr_result,
+                api_key,
+                get_file_hash(file_data),
+                file_data,
+                file_name_stem,
+                inline_mime_type,
+                embed_images
+            ))
+
+    results = []
+    for (name, _), future in zip(files, futures):
+        try:
+            results.append((name, future.result(), None))
+        except Exception as e:
+            results.append((name, None, str(e)))
+    return results
+
 
 # --- Streamlit App ---
 
@@ -203,22 +361,28 @@ with st.sidebar:
     st.subheader("Upload File or Enter URL")
     upload_option = st.radio("Choose input method:", ("Upload from Computer", "Enter URL"), key="input_method")
     
-    uploaded_file_data = None
+    st.session_state.uploaded_file_data = None
     file_name_stem = "ocr_result"
     is_image = False
     is_pdf = False
+    inline_mime_type = None
     original_name_or_url = ""
+    uploaded_files = []
 
     if upload_option == "Upload from Computer":
-        uploaded_file = st.file_uploader(
-            "Choose a PDF or Image file",
-            type=[ext.lstrip('.') for ext in SUPPORTED_FILE_TYPES],
-            key="file_uploader"
+        uploaded_files = st.file_uploader(
+            "Choose PDF or Image files",
+            type=_UPLOADER_EXTS,
+            key="file_uploader",
+            accept_multiple_files=True
         )
-        if uploaded_file is not None:
-            uploaded_file_data = uploaded_file.getvalue()
+        if uploaded_files:
+            # The first file drives the preview; all files are sent to OCR.
+            uploaded_file = uploaded_files[0]
+            st.session_state.uploaded_file_data = uploaded_file.getvalue()
             original_name_or_url = uploaded_file.name
-            st.session_state.uploaded_file_data = uploaded_file_data 
+            if len(uploaded_files) > 1:
+                st.caption(f"{len(uploaded_files)} files selected. Previewing {uploaded_file.name}.")
     
     elif upload_option == "Enter URL":
         file_url = st.text_input("Enter File URL (PDF or Image):", key="url_input")
@@ -226,33 +390,31 @@ with st.sidebar:
             if not (file_url.startswith("http://") or file_url.startswith("https://")):
                 st.error("Invalid URL format. Must start with http:// or https://")
             else:
-                uploaded_file_data = get_data_from_url(file_url) 
+                st.session_state.uploaded_file_data = get_data_from_url(file_url)
                 original_name_or_url = file_url
-                st.session_state.uploaded_file_data = uploaded_file_data 
 
     # --- Process File Name and Type ---
-    if uploaded_file_data:
-        try:
-            path_part = original_name_or_url.split('/')[-1].split('?')[0]
-            file_name_stem = Path(path_part).stem if path_part else "file_from_url"
-        except Exception:
-            file_name_stem = "file_from_url"
-        
-        is_image = any(original_name_or_url.lower().endswith(ext) for ext in SUPPORTED_IMAGE_TYPES)
-        is_pdf = original_name_or_url.lower().endswith('.pdf')
+    if st.session_state.uploaded_file_data:
+        file_name_stem, is_image, is_pdf, inline_mime_type = get_file_info(original_name_or_url)
         
         st.session_state.current_file_name_stem = file_name_stem
         st.session_state.is_image = is_image
         st.session_state.is_pdf = is_pdf
-    else:
-        st.session_state.uploaded_file_data = None
 
 
+    # --- OCR Options ---
+    embed_images = st.checkbox(
+        "Embed images in output",
+        value=False,
+        help="Asks Mistral to return extracted images as base64. Makes the OCR response and downloads much larger. "
+             "When off, images appear as [Image: ...] text markers."
+    )
+
     # --- Process & Clear Buttons ---
     col1, col2 = st.columns(2)
     
     with col1:
-        run_disabled = (not api_key or not uploaded_file_data)
+        run_disabled = (not api_key or not st.session_state.uploaded_file_data)
         if st.button("🚀 Run OCR", disabled=run_disabled, key="run_button", use_container_width=True):
             st.session_state.combined_markdown = None
             st.session_state.ocr_error = None
@@ -262,13 +424,36 @@ with st.sidebar:
                 del st.session_state.markdown_editor
 
             try:
-                st.session_state.combined_markdown = get_ocr_result(
-                    api_key,
-                    uploaded_file_data,
-                    file_name_stem,
-                    is_image 
-                )
-                st.success("OCR Complete!")
+                if len(uploaded_files) > 1:
+                    # The first file's bytes are already in session state; only read the others.
+                    batch_files = [(uploaded_files[0].name, st.session_state.uploaded_file_data)]
+                    batch_files += [(f.name, f.getvalue()) for f in uploaded_files[1:]]
+                    with st.spinner(f"Running OCR on {len(batch_files)} files..."):
+                        results = get_ocr_results_batch(api_key, batch_files, embed_images)
+                    del batch_files
+
+                    st.session_state.combined_markdown = "\n\n---\n\n".join(
+                        f"# {get_file_info(name)[0]}\n\n{markdown}"
+                        for name, markdown, error in results if error is None
+                    ) or None
+                    failures = [f"{name}: {error}" for name, markdown, error in results if error is not None]
+                    if failures:
+                        st.session_state.ocr_error = f"{len(failures)} of {len(results)} files failed. " + "; ".join(failures)
+                        for failure in failures:
+                            st.error(failure)
+                    else:
+                        st.success("OCR Complete!")
+                else:
+                    with st.spinner("Uploading file and running OCR... This may take a moment."):
+                        st.session_state.combined_markdown = get_ocr_result(
+                            api_key,
+                            get_file_hash(st.session_state.uploaded_file_data),
+                            st.session_state.uploaded_file_data,
+                            file_name_stem,
+                            inline_mime_type,
+                            embed_images
+                        )
+                    st.success("OCR Complete!")
             except Exception as e:
                 st.error(f"An error occurred: {e}")
                 st.session_state.ocr_error = str(e)
@@ -299,8 +484,7 @@ with col_input:
             st.image(st.session_state.uploaded_file_data, use_container_width=True)
             
         elif st.session_state.is_pdf:
-            pdf_html = display_pdf(st.session_state.uploaded_file_data, height=600)
-            st.markdown(pdf_html, unsafe_allow_html=True)
+            st.pdf(st.session_state.uploaded_file_data, height=600)
             
     else:
         st.info("Your uploaded file will be displayed here.")